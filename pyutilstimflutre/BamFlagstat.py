@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+# Compute the output of the SamTools FlagStat program directly from SAM/BAM
+# https://github.com/samtools/samtools
+# https://samtools.github.io/hts-specs/SAMv1.pdf
+
+# Copyright (C) 2016 Institut National de la Recherche Agronomique (INRA)
+# License: GPL-3+
+# Persons: Timothée Flutre [cre,aut]
+# Versioning: https://github.com/timflutre/pyutilstimflutre
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import struct
+import zlib
+
+from pyutilstimflutre import SamtoolsFlagstat
+
+# bitwise flags from the SAM specification
+FPAIRED = 0x1
+FPROPER_PAIR = 0x2
+FUNMAP = 0x4
+FMUNMAP = 0x8
+FREAD1 = 0x40
+FREAD2 = 0x80
+FSECONDARY = 0x100
+FQCFAIL = 0x200
+FDUP = 0x400
+FSUPPLEMENTARY = 0x800
+
+# extra bits used to pack the relevant fields of a record into a single key
+KDIFFCHR = 0x10000
+KMAPQ5 = 0x20000
+
+# block_size, refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq,
+# next_refID, next_pos
+recordStruct = struct.Struct("<iiiBBHHHiii")
+
+
+def countBamChunk(args):
+    """
+    Count a range of BGZF blocks (module-level to be usable by multiprocessing).
+    """
+    inFile, startCoffset, startUoffset, endCoffset, nRef = args
+    return BamFlagstat.countBamRange(inFile, startCoffset, startUoffset,
+                                     endCoffset, nRef)
+
+
+def countSamChunk(args):
+    """
+    Count a byte range of a SAM file (module-level to be usable by
+    multiprocessing).
+    """
+    inFile, start, end = args
+    return BamFlagstat.countSamRange(inFile, start, end)
+
+
+class BgzfStream(object):
+    """
+    Sequentially decompress BGZF blocks with zlib, keeping track of the virtual
+    offset (block offset in the file, offset in the uncompressed block) of the
+    data not yet consumed.
+    """
+    
+    @staticmethod
+    def readBlock(inHandle, decompress=True):
+        """
+        Return the compressed size of the next block and its uncompressed data
+        (None if decompress is False), or None at the end of the file.
+        """
+        header = inHandle.read(12)
+        if len(header) == 0:
+            return None
+        if len(header) < 12 or header[:2] != b"\x1f\x8b" \
+           or not bytearray(header)[3] & 4:
+            msg = "invalid BGZF block header"
+            raise ValueError(msg)
+        xlen = struct.unpack_from("<H", header, 10)[0]
+        extra = inHandle.read(xlen)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            si1, si2, slen = struct.unpack_from("<BBH", extra, i)
+            if si1 == 66 and si2 == 67: # "BC"
+                bsize = struct.unpack_from("<H", extra, i + 4)[0]
+            i += 4 + slen
+        if bsize is None:
+            msg = "BGZF block without BSIZE"
+            raise ValueError(msg)
+        if not decompress:
+            inHandle.seek(bsize - xlen - 11, os.SEEK_CUR)
+            return bsize + 1, None
+        cdata = inHandle.read(bsize - xlen - 19)
+        inHandle.read(8) # CRC32 and ISIZE
+        return bsize + 1, zlib.decompress(cdata, -15)
+        
+    @staticmethod
+    def getBlockOffsets(inFile):
+        """
+        Return the offsets of all blocks, reading only their headers.
+        """
+        lOffsets = []
+        coffset = 0
+        inHandle = open(inFile, "rb")
+        while True:
+            res = BgzfStream.readBlock(inHandle, False)
+            if res is None:
+                break
+            lOffsets.append(coffset)
+            coffset += res[0]
+        inHandle.close()
+        return lOffsets
+        
+    def __init__(self, inFile, coffset=0, endCoffset=None):
+        self.inHandle = open(inFile, "rb")
+        self.inHandle.seek(coffset)
+        self.coffset = coffset # offset of the next block to read
+        self.endCoffset = endCoffset
+        self.data = b""
+        self.lBlocks = [] # list of (block offset, start in self.data)
+        self.stopPos = sys.maxsize # start in self.data of the first block at or after endCoffset
+        
+    def close(self):
+        self.inHandle.close()
+        
+    def readNextBlock(self):
+        res = BgzfStream.readBlock(self.inHandle)
+        if res is None:
+            return False
+        if self.endCoffset is not None and self.coffset >= self.endCoffset \
+           and self.stopPos == sys.maxsize:
+            self.stopPos = len(self.data)
+        self.lBlocks.append((self.coffset, len(self.data)))
+        self.data += res[1]
+        self.coffset += res[0]
+        return True
+        
+    def ensure(self, end):
+        """
+        Return False if the file ends before end.
+        """
+        while len(self.data) < end:
+            if not self.readNextBlock():
+                return False
+        return True
+        
+    def trim(self, pos):
+        """
+        Drop the blocks entirely before pos, and return the new value of pos.
+        """
+        idx = 0
+        while idx + 1 < len(self.lBlocks) and self.lBlocks[idx+1][1] <= pos:
+            idx += 1
+        if len(self.lBlocks) == 0 or self.lBlocks[idx][1] == 0:
+            return pos
+        shift = self.lBlocks[idx][1]
+        self.data = self.data[shift:]
+        self.lBlocks = [(c, s - shift) for c,s in self.lBlocks[idx:]]
+        if self.stopPos != sys.maxsize:
+            self.stopPos -= shift
+        return pos - shift
+        
+    def getVirtual(self, pos):
+        for coffset, start in reversed(self.lBlocks):
+            if start <= pos:
+                return (coffset, pos - start)
+        return (self.coffset, 0)
+        
+        
+class BamFlagstat(SamtoolsFlagstat):
+    """
+    Compute the same counters as `samtools flagstat' (version 1.10 and above)
+    from a SAM or BAM file, without samtools.
+    Only the flag, mapping quality and reference ids of each record are read.
+    """
+    
+    # records larger than this are ignored when looking for the first record of
+    # a chunk, to avoid decompressing a lot of data for a false positive
+    maxResyncSize = 4 * 1024 * 1024
+    
+    @staticmethod
+    def checkRecord(data, pos, nRef):
+        """
+        Return the block size of the record starting at pos if it looks valid,
+        None otherwise.
+        """
+        (bs, refId, p, lName, mapq, bin, nCigar, flag, lSeq, nextRefId,
+         nextPos) = recordStruct.unpack_from(data, pos)
+        if bs < 32 or bs > BamFlagstat.maxResyncSize \
+           or lName < 1 or lSeq < 0 or p < -1 or nextPos < -1 \
+           or refId < -1 or refId >= nRef \
+           or nextRefId < -1 or nextRefId >= nRef:
+            return None
+        if 32 + lName + 4 * nCigar + lSeq + (lSeq + 1) // 2 > bs:
+            return None
+        end = pos + 36 + lName
+        if end <= len(data) and data[end-1:end] != b"\x00":
+            return None
+        return bs
+        
+    @staticmethod
+    def isRecordChain(stream, pos, nRef, nbRecords=3):
+        for i in range(nbRecords):
+            if not stream.ensure(pos + 36):
+                return pos == len(stream.data)
+            bs = BamFlagstat.checkRecord(stream.data, pos, nRef)
+            if bs is None:
+                return False
+            pos += 4 + bs
+        return True
+        
+    @staticmethod
+    def findRecordStart(stream, nRef):
+        """
+        Return the position of the first record starting before stream.stopPos,
+        or None.
+        """
+        pos = 0
+        while pos < stream.stopPos:
+            if not stream.ensure(pos + 36):
+                return None
+            if pos < stream.stopPos \
+               and BamFlagstat.isRecordChain(stream, pos, nRef):
+                return pos
+            pos += 1
+        return None
+        
+    @staticmethod
+    def parseBamHeader(stream, inFile):
+        """
+        Return the number of reference sequences and the position of the first
+        record.
+        """
+        if not stream.ensure(12) or stream.data[:4] != b"BAM\x01":
+            msg = "file '%s' isn't a valid BAM file" % inFile
+            raise ValueError(msg)
+        pos = 8 + struct.unpack_from("<i", stream.data, 4)[0]
+        stream.ensure(pos + 4)
+        nRef = struct.unpack_from("<i", stream.data, pos)[0]
+        pos += 4
+        for i in range(nRef):
+            if not stream.ensure(pos + 4):
+                msg = "file '%s' seems truncated" % inFile
+                raise ValueError(msg)
+            pos += 4 + struct.unpack_from("<i", stream.data, pos)[0] + 4
+        stream.ensure(pos)
+        return nRef, pos
+        
+    @staticmethod
+    def countBamRange(inFile, startCoffset, startUoffset, endCoffset, nRef):
+        """
+        Count the records starting in the blocks from startCoffset (at
+        startUoffset, or at the first plausible record if None) to endCoffset
+        (excluded; None for the end of the file).
+        Return the counts per key, as well as the virtual offsets of the first
+        record counted and of the first record not counted (None at the end of
+        the file).
+        """
+        dKeys = {}
+        stream = BgzfStream(inFile, startCoffset, endCoffset)
+        if startUoffset is None:
+            pos = BamFlagstat.findRecordStart(stream, nRef)
+            if pos is None:
+                stream.close()
+                return dKeys, None, None
+        else:
+            pos = startUoffset
+            stream.ensure(pos)
+        startVirtual = stream.getVirtual(pos)
+        endVirtual = None
+        unpackFrom = recordStruct.unpack_from
+        while True:
+            data = stream.data
+            n = len(data)
+            stopPos = stream.stopPos
+            while pos + 36 <= n and pos < stopPos:
+                (bs, refId, p, lName, mapq, bin, nCigar, flag, lSeq,
+                 nextRefId, nextPos) = unpackFrom(data, pos)
+                if pos + 4 + bs > n:
+                    break
+                key = flag
+                if refId != nextRefId:
+                    key |= KDIFFCHR
+                if mapq >= 5:
+                    key |= KMAPQ5
+                dKeys[key] = dKeys.get(key, 0) + 1
+                pos += 4 + bs
+            if pos >= stopPos:
+                endVirtual = stream.getVirtual(pos)
+                break
+            pos = stream.trim(pos)
+            if not stream.readNextBlock():
+                if pos < len(stream.data):
+                    msg = "file '%s' seems truncated" % inFile
+                    raise ValueError(msg)
+                break
+        stream.close()
+        return dKeys, startVirtual, endVirtual
+        
+    @staticmethod
+    def countSamRange(inFile, start=0, end=None):
+        """
+        Count the records starting in [start, end) (end=None for the end of the
+        file), start being the beginning of a line.
+        """
+        dKeys = {}
+        inHandle = open(inFile, "rb")
+        inHandle.seek(start)
+        pos = start
+        for line in inHandle:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            if line[:1] == b"@":
+                continue
+            tokens = line.split(b"\t", 7)
+            if len(tokens) < 8:
+                msg = "line at byte %i of file '%s' has less than 8 columns" % \
+                      (pos - len(line), inFile)
+                raise ValueError(msg)
+            key = int(tokens[1])
+            if tokens[6] != b"=" and tokens[6] != tokens[2]:
+                key |= KDIFFCHR
+            if int(tokens[4]) >= 5:
+                key |= KMAPQ5
+            dKeys[key] = dKeys.get(key, 0) + 1
+        inHandle.close()
+        return dKeys
+        
+    @staticmethod
+    def mergeKeys(dKeys, dOther):
+        for key, nb in dOther.items():
+            dKeys[key] = dKeys.get(key, 0) + nb
+        return dKeys
+        
+    def __init__(self, inFile, nbProcs=1):
+        """
+        Work is split across nbProcs processes, by ranges of BGZF blocks for
+        BAM files, and by byte ranges for SAM files.
+        """
+        self.inFile = inFile
+        if not os.path.exists(self.inFile):
+            msg = "can't find file '%s'" % self.inFile
+            raise ValueError(msg)
+        self.nbProcs = nbProcs
+        self.lStats = SamtoolsFlagstat.initListStats()
+        self.lExtraStats = SamtoolsFlagstat.initListExtraStats()
+        self.format = None # "sam" or "bam", set by self.load()
+        self.load()
+        
+    def mapChunks(self, func, lChunks):
+        if len(lChunks) == 1:
+            return [func(lChunks[0])]
+        import multiprocessing # slow to import
+        pool = multiprocessing.Pool(len(lChunks))
+        lResults = pool.map(func, lChunks)
+        pool.close()
+        pool.join()
+        return lResults
+        
+    def countBam(self):
+        stream = BgzfStream(self.inFile)
+        nRef, pos = BamFlagstat.parseBamHeader(stream, self.inFile)
+        startCoffset, startUoffset = stream.getVirtual(pos)
+        stream.close()
+        lChunks = [(self.inFile, startCoffset, startUoffset, None, nRef)]
+        if self.nbProcs > 1:
+            lOffsets = [c for c in BgzfStream.getBlockOffsets(self.inFile)
+                        if c > startCoffset]
+            if len(lOffsets) >= 2 * self.nbProcs:
+                lBounds = [lOffsets[i * len(lOffsets) // self.nbProcs]
+                           for i in range(1, self.nbProcs)]
+                lChunks = [(self.inFile, startCoffset, startUoffset,
+                            lBounds[0], nRef)]
+                for i in range(len(lBounds)):
+                    lChunks.append((self.inFile, lBounds[i], None,
+                                    lBounds[i+1] if i + 1 < len(lBounds) else None,
+                                    nRef))
+        lResults = self.mapChunks(countBamChunk, lChunks)
+        
+        # each chunk should start exactly where the previous one stopped,
+        # otherwise a record start was misidentified: count sequentially
+        isConsistent = True
+        endVirtual = lResults[0][2]
+        for dKeys, startVirtual, nextEndVirtual in lResults[1:]:
+            if startVirtual is None:
+                continue
+            if startVirtual != endVirtual:
+                isConsistent = False
+                break
+            endVirtual = nextEndVirtual
+        if not isConsistent or endVirtual is not None:
+            return countBamChunk((self.inFile, startCoffset, startUoffset,
+                                  None, nRef))[0]
+        dKeys = {}
+        for res in lResults:
+            BamFlagstat.mergeKeys(dKeys, res[0])
+        return dKeys
+        
+    def countSam(self):
+        fileSize = os.path.getsize(self.inFile)
+        lOffsets = [0]
+        if self.nbProcs > 1:
+            inHandle = open(self.inFile, "rb")
+            for i in range(1, self.nbProcs):
+                inHandle.seek(i * fileSize // self.nbProcs - 1)
+                offset = inHandle.tell() + len(inHandle.readline())
+                if offset > lOffsets[-1] and offset < fileSize:
+                    lOffsets.append(offset)
+            inHandle.close()
+        lOffsets.append(None)
+        lChunks = [(self.inFile, lOffsets[i], lOffsets[i+1])
+                   for i in range(len(lOffsets) - 1)]
+        dKeys = {}
+        for dOther in self.mapChunks(countSamChunk, lChunks):
+            BamFlagstat.mergeKeys(dKeys, dOther)
+        return dKeys
+        
+    def load(self):
+        inHandle = open(self.inFile, "rb")
+        magic = inHandle.read(2)
+        inHandle.close()
+        if magic == b"\x1f\x8b":
+            self.format = "bam"
+            dKeys = self.countBam()
+        else:
+            self.format = "sam"
+            dKeys = self.countSam()
+        self.setStatsFromKeys(dKeys)
+        
+    def setStatsFromKeys(self, dKeys):
+        """
+        Same rules as bam_flagstat_core() in samtools' bam_stat.c.
+        """
+        dCounts = dict((dStat["id"], [0, 0]) for dStat
+                       in self.lStats + self.lExtraStats)
+        for key, nb in dKeys.items():
+            flag = key & 0xffff
+            w = 1 if flag & FQCFAIL else 0
+            lIds = ["total"]
+            if flag & FSECONDARY:
+                lIds.append("second")
+            elif flag & FSUPPLEMENTARY:
+                lIds.append("suppl")
+            else:
+                lIds.append("primary")
+                if flag & FPAIRED:
+                    lIds.append("pairedseq")
+                    if flag & FPROPER_PAIR and not flag & FUNMAP:
+                        lIds.append("proppaired")
+                    if flag & FREAD1:
+                        lIds.append("r1")
+                    if flag & FREAD2:
+                        lIds.append("r2")
+                    if flag & FMUNMAP and not flag & FUNMAP:
+                        lIds.append("single")
+                    if not flag & FUNMAP and not flag & FMUNMAP:
+                        lIds.append("itmatemap")
+                        if key & KDIFFCHR:
+                            lIds.append("matediffchr")
+                            if key & KMAPQ5:
+                                lIds.append("matediffchrQ5")
+                if not flag & FUNMAP:
+                    lIds.append("primarymap")
+                if flag & FDUP:
+                    lIds.append("primarydupl")
+            if not flag & FUNMAP:
+                lIds.append("map")
+            if flag & FDUP:
+                lIds.append("dupl")
+            for statId in lIds:
+                dCounts[statId][w] += nb
+                
+        for dStat in self.lStats + self.lExtraStats:
+            dStat["qc.passed"], dStat["qc.failed"] = dCounts[dStat["id"]]
@@ -10,7 +10,18 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import sys
+import array
+import numbers
 import sqlite3
+import contextlib
+import threading
+try:
+    import queue
+    from urllib.request import pathname2url
+except ImportError: # Python 2
+    import Queue as queue
+    from urllib import pathname2url
 
 
 class DbSqlite(object):
@@ -18,24 +29,247 @@ class DbSqlite(object):
     Wraps code from sqlite3.
     """
     
-    def __init__(self, path2db):
-        if os.path.exists(path2db):
+    # pragmas suited to bulk loads, see https://www.sqlite.org/pragma.html
+    dFastPragmas = {"journal_mode": "WAL",
+                    "synchronous": "NORMAL",
+                    "cache_size": -64000, # in KiB when negative
+                    "mmap_size": 268435456}
+    
+    def __init__(self, path2db, mode="create", dPragmas=None,
+                 checkSameThread=True):
+        """
+        The mode can be "create" (the db shouldn't exist yet), "rw" (read-write)
+        or "ro" (read-only), the db having to exist for the last two.
+        If checkSameThread is False, the connection can be closed from another
+        thread than the one which created it (see DbSqlitePool).
+        """
+        if mode not in ["create", "rw", "ro"]:
+            msg = "unknown mode '%s'" % mode
+            raise ValueError(msg)
+        if mode == "create" and os.path.exists(path2db):
             msg = "db '%s' already exists" % path2db
             raise ValueError(msg)
+        if mode != "create" and not os.path.exists(path2db):
+            msg = "can't find db '%s'" % path2db
+            raise ValueError(msg)
         self.db = path2db
-        self.conn = sqlite3.connect(self.db)
+        self.mode = mode
+        self.inTransaction = False
+        if mode == "ro":
+            try:
+                # characters such as "?" or "#" have to be escaped in a URI
+                uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(path2db))
+                self.conn = sqlite3.connect(uri, uri=True,
+                                            check_same_thread=checkSameThread)
+            except TypeError: # uri isn't available before Python 3.4
+                self.conn = sqlite3.connect(self.db,
+                                            check_same_thread=checkSameThread)
+                self.conn.execute("PRAGMA query_only=ON;")
+        else:
+            self.conn = sqlite3.connect(self.db,
+                                        check_same_thread=checkSameThread)
         self.cur = self.conn.cursor()
+        if dPragmas:
+            for name in dPragmas:
+                self.setPragma(name, dPragmas[name])
+                
+    def close(self):
+        # an open cursor keeps the connection alive, and the WAL file wouldn't
+        # be checkpointed into the db
+        self.cur.close()
+        self.conn.close()
         
-    def execute(self, cmd):
-        self.cur.execute(cmd)
-        
-    def commit(self):
-        self.conn.commit()
+    def setPragma(self, name, value):
+        cmd = "PRAGMA %s=%s;" % (name, value)
+        self.execute(cmd)
+        self.cur.fetchall()
         
-    def execomm(self, cmd):
+    def getPragma(self, name):
+        cmd = "PRAGMA %s;" % name
         self.execute(cmd)
+        res = self.cur.fetchone()
+        return None if res is None else res[0]
+    
+    def execute(self, cmd, params=None):
+        """
+        Values should be given via params (sequence for "?" placeholders, or
+        dictionary for named ones) rather than formatted into cmd.
+        """
+        if params is None:
+            self.cur.execute(cmd)
+        else:
+            self.cur.execute(cmd, params)
+            
+    def executemany(self, cmd, seqParams):
+        """
+        Execute cmd for each item of seqParams (which can be a generator).
+        """
+        self.cur.executemany(cmd, seqParams)
+        
+    def commit(self):
+        """
+        Commit, unless inside self.transaction() which commits at its end.
+        """
+        if not self.inTransaction:
+            self.conn.commit()
+            
+    def execomm(self, cmd, params=None):
+        self.execute(cmd, params)
         self.commit()
         
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group statements into a single transaction, committed at the end of the
+        block, or rolled back if an exception is raised, e.g.:
+        with db.transaction():
+            db.executemany("INSERT INTO jobs VALUES (?, ?)", lRows)
+        """
+        if self.inTransaction:
+            yield self
+            return
+        self.inTransaction = True
+        try:
+            yield self
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        finally:
+            self.inTransaction = False
+            
+    def iterChunks(self, cmd, params=None, chunkSize=10000):
+        """
+        Yield the rows returned by cmd as lists of at most chunkSize tuples,
+        using a dedicated cursor so that self.cur can be used meanwhile.
+        """
+        cur = self.conn.cursor()
+        try:
+            if params is None:
+                cur.execute(cmd)
+            else:
+                cur.execute(cmd, params)
+            while True:
+                lRows = cur.fetchmany(chunkSize)
+                if not lRows:
+                    break
+                yield lRows
+        finally:
+            cur.close()
+            
+    def iterRows(self, cmd, params=None, chunkSize=10000):
+        """
+        Yield the rows returned by cmd one by one, fetching them by chunks.
+        """
+        for lRows in self.iterChunks(cmd, params, chunkSize):
+            for row in lRows:
+                yield row
+                
+    @staticmethod
+    def fillNull(values, typecode):
+        fill = float("nan") if typecode == "d" else 0
+        return [fill if v is None else v for v in values]
+    
+    @staticmethod
+    def extendColumn(col, mask, values):
+        """
+        Append values to a column and to its mask of NULL values (None until
+        the first NULL), and return both.
+        The column is an array.array of integers (of floats once a float is
+        met) as long as all values are numbers or NULL, NULL being stored as 0
+        (NaN), and a list otherwise, NULL being then stored as None.
+        """
+        if isinstance(col, list):
+            col.extend(values)
+            return col, None
+        hasNull = None in values
+        if hasNull and mask is None:
+            mask = array.array(str("b"), [0]) * len(col)
+        length = len(col)
+        try:
+            col.extend(DbSqlite.fillNull(values, col.typecode) if hasNull
+                       else values)
+        except (TypeError, OverflowError) as e:
+            del col[length:] # values appended before the failing one
+            if isinstance(e, TypeError) and col.typecode != "d" \
+               and all(v is None or isinstance(v, numbers.Real)
+                       for v in values):
+                col = array.array(str("d"), col)
+                if mask is not None:
+                    for i in range(length):
+                        if mask[i]:
+                            col[i] = float("nan")
+                col.extend(DbSqlite.fillNull(values, "d"))
+            else:
+                if mask is not None:
+                    col = [None if isNull else v for v,isNull in zip(col, mask)]
+                else:
+                    col = list(col)
+                col.extend(values)
+                return col, None
+        if mask is not None:
+            mask.extend([1 if v is None else 0 for v in values])
+        return col, mask
+    
+    def fetchColumns(self, cmd, params=None, chunkSize=10000, useNumpy=False,
+                     dMasks=None):
+        """
+        Return a dictionary with key=column name and value=column of the result
+        of cmd, filled chunk by chunk.
+        Columns of integers or floats are stored in compact arrays (array.array,
+        or NumPy arrays if useNumpy is True), other columns in lists (object
+        arrays with NumPy).
+        For numeric columns having NULL:
+        - with useNumpy, masked arrays are returned;
+        - if dMasks is a dictionary, it is filled with key=column name and
+        value=array.array (1 for NULL), NULL being stored as 0 or NaN;
+        - otherwise, NULL are stored as NaN in columns of floats (sqlite having
+        no NaN, they can't be confused), and columns of integers are returned
+        as lists with None.
+        """
+        cur = self.conn.cursor()
+        try:
+            if params is None:
+                cur.execute(cmd)
+            else:
+                cur.execute(cmd, params)
+            lNames = [desc[0] for desc in cur.description]
+            intTypecode = str("q") if sys.version_info[0] >= 3 else str("l")
+            lCols = [array.array(intTypecode) for name in lNames]
+            lMasks = [None for name in lNames]
+            while True:
+                lRows = cur.fetchmany(chunkSize)
+                if not lRows:
+                    break
+                for j,values in enumerate(zip(*lRows)):
+                    lCols[j], lMasks[j] = DbSqlite.extendColumn(lCols[j],
+                                                                lMasks[j],
+                                                                values)
+        finally:
+            cur.close()
+            
+        if useNumpy:
+            import numpy as np # optional dependency
+            for j,col in enumerate(lCols):
+                if isinstance(col, list):
+                    lCols[j] = np.array(col, dtype=object)
+                else:
+                    lCols[j] = np.frombuffer(col, dtype=col.typecode).copy()
+                    if lMasks[j] is not None:
+                        mask = np.frombuffer(lMasks[j], dtype="b").astype(bool)
+                        lCols[j] = np.ma.masked_array(lCols[j], mask=mask)
+        else:
+            for j,mask in enumerate(lMasks):
+                if mask is None:
+                    continue
+                if dMasks is not None:
+                    dMasks[lNames[j]] = mask
+                elif lCols[j].typecode != "d":
+                    lCols[j] = [None if isNull else v
+                                for v,isNull in zip(lCols[j], mask)]
+        return dict(zip(lNames, lCols))
+    
     def doesTableExist(self, table):
         cmd = "PRAGMA table_info(\"%s\");" % table
         self.execute(cmd)
@@ -50,3 +284,174 @@ class DbSqlite(object):
             msg = "table '%s' doesn't exist" % table
             raise ValueError(msg)
         return [col[1] for col in res]
+        
+        
+class DbSqlitePool(object):
+    """
+    Share a db between several threads (e.g. workers of a thread pool or of an
+    asyncio executor): each thread gets its own connection, the db being in WAL
+    mode so that readers don't block each other nor the writer.
+    If useWriter is True, all writes go through a single writer thread fed by a
+    queue, which commits them in batches, so that writers never wait on the
+    lock of the db.
+    """
+    
+    dPoolPragmas = dict(DbSqlite.dFastPragmas, busy_timeout=30000) # in ms
+    
+    def __init__(self, path2db, dPragmas=None, useWriter=False, maxBatch=1000):
+        if not os.path.exists(path2db):
+            DbSqlite(path2db).close()
+        self.db = path2db
+        self.dPragmas = DbSqlitePool.dPoolPragmas if dPragmas is None \
+                        else dPragmas
+        self.local = threading.local()
+        self.lDbs = [] # all connections, to close them at the end
+        self.lock = threading.Lock()
+        self.useWriter = useWriter
+        self.maxBatch = maxBatch
+        self.lErrors = [] # errors of writes which weren't waited for
+        self.queue = None
+        self.writer = None
+        if self.useWriter:
+            self.queue = queue.Queue()
+            self.writer = threading.Thread(target=self.runWriter)
+            self.writer.daemon = True
+            self.writer.start()
+            
+    def getDb(self):
+        """
+        Return the DbSqlite object of the current thread.
+        """
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = DbSqlite(self.db, mode="rw", dPragmas=self.dPragmas,
+                          checkSameThread=False)
+            self.local.db = db
+            with self.lock:
+                self.lDbs.append(db)
+        return db
+    
+    def runWriter(self):
+        db = None
+        isStopping = False
+        while not isStopping:
+            lItems = [self.queue.get()]
+            while len(lItems) < self.maxBatch:
+                try:
+                    lItems.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in lItems:
+                isStopping = True
+                lItems = [item for item in lItems if item is not None]
+            try:
+                if db is None:
+                    db = self.getDb()
+                self.executeBatch(db, lItems)
+            except Exception as e:
+                # e.g. the db can't be opened: fail the writes rather than
+                # leaving their callers waiting
+                for item in lItems:
+                    if item["error"] is None:
+                        item["error"] = e
+            finally:
+                for item in lItems:
+                    if item["error"] is not None and not item["wait"]:
+                        with self.lock:
+                            self.lErrors.append(item["error"])
+                    item["done"].set()
+                    
+    def executeBatch(self, db, lItems):
+        try:
+            with db.transaction():
+                for item in lItems:
+                    self.executeItem(db, item)
+        except Exception:
+            # retry one by one, so that only the faulty writes fail
+            for item in lItems:
+                try:
+                    with db.transaction():
+                        self.executeItem(db, item)
+                except Exception as e:
+                    item["error"] = e
+                    
+    @staticmethod
+    def executeItem(db, item):
+        if item["cmd"] is None: # flush
+            return
+        if item["isMany"]:
+            db.executemany(item["cmd"], item["params"])
+        else:
+            db.execute(item["cmd"], item["params"])
+            
+    def write(self, cmd, params=None, isMany=False, wait=True):
+        if not self.useWriter:
+            db = self.getDb()
+            with db.transaction():
+                if isMany:
+                    db.executemany(cmd, params)
+                else:
+                    db.execute(cmd, params)
+            return
+        item = {"cmd": cmd, "params": params, "isMany": isMany, "wait": wait,
+                "error": None, "done": threading.Event()}
+        self.queue.put(item)
+        if wait:
+            item["done"].wait()
+            if item["error"] is not None:
+                raise item["error"]
+            
+    def execomm(self, cmd, params=None, wait=True):
+        """
+        Execute and commit a write; with the writer thread, if wait is False,
+        return as soon as it is queued (errors being raised by flush()).
+        """
+        self.write(cmd, params, False, wait)
+        
+    def executemany(self, cmd, seqParams, wait=True):
+        if self.useWriter:
+            # a generator couldn't be re-played if its batch has to be retried
+            seqParams = list(seqParams)
+        self.write(cmd, seqParams, True, wait)
+        
+    def flush(self):
+        """
+        Wait until all queued writes are committed.
+        """
+        if self.useWriter:
+            self.write(None)
+        with self.lock:
+            lErrors, self.lErrors = self.lErrors, []
+        if len(lErrors) > 0:
+            msg = "%i write(s) failed, first error: %s" % (len(lErrors),
+                                                           lErrors[0])
+            raise ValueError(msg)
+        
+    def iterRows(self, cmd, params=None, chunkSize=10000):
+        return self.getDb().iterRows(cmd, params, chunkSize)
+    
+    def iterChunks(self, cmd, params=None, chunkSize=10000):
+        return self.getDb().iterChunks(cmd, params, chunkSize)
+    
+    def fetchColumns(self, cmd, params=None, chunkSize=10000, useNumpy=False,
+                     dMasks=None):
+        return self.getDb().fetchColumns(cmd, params, chunkSize, useNumpy,
+                                         dMasks)
+    
+    def close(self):
+        """
+        Wait for the queued writes (raising if some of them failed, as flush())
+        and close all connections.
+        """
+        try:
+            if self.writer is not None:
+                self.flush()
+        finally:
+            if self.writer is not None:
+                self.queue.put(None)
+                self.writer.join()
+                self.writer = None
+            with self.lock:
+                for db in self.lDbs:
+                    db.close()
+                self.lDbs = []
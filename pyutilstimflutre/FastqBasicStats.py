@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Compute the "Basic Statistics" module of FastQC directly from a FASTQ file
+# http://www.bioinformatics.babraham.ac.uk/projects/fastqc/
+
+# Copyright (C) 2016 Institut National de la Recherche Agronomique (INRA)
+# License: GPL-3+
+# Persons: Timothée Flutre [cre,aut]
+# Versioning: https://github.com/timflutre/pyutilstimflutre
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import gzip
+
+from pyutilstimflutre import Fastqc
+
+
+def countChunk(args):
+    """
+    Count a byte range of a FASTQ file (module-level to be usable by
+    multiprocessing).
+    """
+    inFile, start, end, blockSize = args
+    return FastqBasicStats.countRange(inFile, start, end, blockSize)
+
+
+class FastqBasicStats(object):
+    """
+    Compute the "Basic Statistics" of `fastqc' (same layout as version 0.11.2)
+    from a plain or gzipped FASTQ file, without launching Java.
+    """
+    
+    @staticmethod
+    def initCounts():
+        """
+        Return [nb of sequences, min length, max length, lowest quality char,
+        nb of A+T, nb of G+C].
+        """
+        return [0, None, None, None, 0, 0]
+        
+    @staticmethod
+    def mergeCounts(counts, other):
+        if other[0] == 0:
+            return counts
+        if counts[0] == 0:
+            return list(other)
+        return [counts[0] + other[0],
+                min(counts[1], other[1]),
+                max(counts[2], other[2]),
+                min(counts[3], other[3]),
+                counts[4] + other[4],
+                counts[5] + other[5]]
+                
+    @staticmethod
+    def updateCounts(counts, lines, inFile):
+        """
+        Update the counts in bulk from a list of lines made of complete records.
+        """
+        if len(lines) == 0:
+            return counts
+        for header in lines[0::4]:
+            if header[:1] != b"@":
+                msg = "record in '%s' doesn't start with '@'" % inFile
+                raise ValueError(msg)
+        seqs = lines[1::4]
+        lLens = [len(seq) for seq in seqs]
+        allSeqs = b"".join(seqs)
+        nbGC = allSeqs.count(b"G") + allSeqs.count(b"C") \
+               + allSeqs.count(b"g") + allSeqs.count(b"c")
+        nbAT = allSeqs.count(b"A") + allSeqs.count(b"T") \
+               + allSeqs.count(b"a") + allSeqs.count(b"t")
+        # rather than taking the min over all chars, only look for chars lower
+        # than the current lowest one (usually none are left)
+        lowestChar = counts[3]
+        if lowestChar is None:
+            lowestChar = min(bytearray(lines[3])) if len(lines[3]) > 0 else 127
+        allQuals = b"".join(lines[3::4])
+        lowerQuals = allQuals.translate(None,
+                                        bytes(bytearray(range(lowestChar, 256))))
+        if len(lowerQuals) > 0:
+            lowestChar = min(bytearray(lowerQuals))
+        return FastqBasicStats.mergeCounts(counts,
+                                           [len(seqs), min(lLens), max(lLens),
+                                            lowestChar, nbAT, nbGC])
+                                            
+    @staticmethod
+    def openFastq(inFile):
+        if inFile.endswith(".gz"):
+            return gzip.open(inFile, "rb")
+        return open(inFile, "rb")
+        
+    @staticmethod
+    def countRange(inFile, start=0, end=None, blockSize=4*1024*1024):
+        """
+        Stream the records starting in [start, end) by blocks of blockSize bytes.
+        If end is None, read until the end of the file.
+        """
+        counts = FastqBasicStats.initCounts()
+        inHandle = FastqBasicStats.openFastq(inFile)
+        if start > 0:
+            inHandle.seek(start)
+        remaining = None if end is None else end - start
+        leftover = b""
+        while True:
+            size = blockSize if remaining is None else min(blockSize, remaining)
+            block = inHandle.read(size) if size > 0 else b""
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            if b"\r" in block:
+                block = block.replace(b"\r", b"")
+            lines = (leftover + block).split(b"\n")
+            nbCompleteLines = ((len(lines) - 1) // 4) * 4
+            counts = FastqBasicStats.updateCounts(counts,
+                                                  lines[:nbCompleteLines],
+                                                  inFile)
+            leftover = b"\n".join(lines[nbCompleteLines:])
+        inHandle.close()
+        
+        lines = leftover.split(b"\n")
+        while len(lines) > 0 and lines[-1] == b"":
+            lines.pop()
+        if len(lines) % 4 != 0:
+            msg = "file '%s' seems truncated" % inFile
+            raise ValueError(msg)
+        return FastqBasicStats.updateCounts(counts, lines, inFile)
+        
+    @staticmethod
+    def findRecordStart(inHandle, pos):
+        """
+        Return the offset of the first record starting at or after pos.
+        A header line starts with '@' and is followed two lines below by a line
+        starting with '+' (a quality line starting with '@' is followed two lines
+        below by a sequence line).
+        """
+        if pos == 0:
+            return 0
+        inHandle.seek(pos - 1)
+        pos += len(inHandle.readline()) - 1
+        window = [] # list of (offset, line)
+        while True:
+            line = inHandle.readline()
+            if not line:
+                return pos if len(window) == 0 else window[0][0]
+            window.append((pos, line))
+            pos += len(line)
+            if len(window) == 3:
+                if window[0][1][:1] == b"@" and window[2][1][:1] == b"+":
+                    return window[0][0]
+                window.pop(0)
+                
+    def __init__(self, inFile, nbProcs=1, blockSize=4*1024*1024):
+        """
+        Work is split across nbProcs processes by byte ranges, which is only
+        possible for uncompressed files (gzipped files are streamed by a single
+        process).
+        """
+        self.inFile = inFile
+        if not os.path.exists(self.inFile):
+            msg = "can't find file '%s'" % self.inFile
+            raise ValueError(msg)
+        self.nbProcs = nbProcs
+        self.blockSize = blockSize
+        self.lStats = Fastqc.initListStats()
+        self.load()
+        
+    def getChunks(self):
+        fileSize = os.path.getsize(self.inFile)
+        if self.inFile.endswith(".gz") or self.nbProcs < 2 \
+           or fileSize < 2 * self.blockSize:
+            return [(self.inFile, 0, None, self.blockSize)]
+        inHandle = open(self.inFile, "rb")
+        lOffsets = [0]
+        for i in range(1, self.nbProcs):
+            offset = FastqBasicStats.findRecordStart(inHandle,
+                                                     i * fileSize // self.nbProcs)
+            if offset > lOffsets[-1]:
+                lOffsets.append(offset)
+        inHandle.close()
+        lOffsets.append(fileSize)
+        return [(self.inFile, lOffsets[i], lOffsets[i+1], self.blockSize)
+                for i in range(len(lOffsets) - 1)]
+                
+    def load(self):
+        lChunks = self.getChunks()
+        if len(lChunks) == 1:
+            lCounts = [countChunk(lChunks[0])]
+        else:
+            import multiprocessing # slow to import
+            pool = multiprocessing.Pool(len(lChunks))
+            lCounts = pool.map(countChunk, lChunks)
+            pool.close()
+            pool.join()
+        counts = FastqBasicStats.initCounts()
+        for other in lCounts:
+            counts = FastqBasicStats.mergeCounts(counts, other)
+        nbSeqs, minLen, maxLen, lowestChar, nbAT, nbGC = counts
+        
+        self.lStats[1]["status"] = "pass"
+        dValues = {"file.name": os.path.basename(self.inFile),
+                   "file.type": "Conventional base calls",
+                   "encod": FastqBasicStats.getEncoding(lowestChar),
+                   "total.nb.sequences": "%i" % nbSeqs,
+                   "seq.poor.qual": "0",
+                   "seq.len": "0",
+                   "perc.gc": "0"}
+        if nbSeqs > 0:
+            if minLen == maxLen:
+                dValues["seq.len"] = "%i" % minLen
+            else:
+                dValues["seq.len"] = "%i-%i" % (minLen, maxLen)
+        if nbAT + nbGC > 0:
+            dValues["perc.gc"] = "%i" % ((nbGC * 100) // (nbAT + nbGC))
+        for dStat in self.lStats[1]["content"]:
+            dStat["value"] = dValues[dStat["id"]]
+            
+    @staticmethod
+    def getEncoding(lowestChar):
+        """
+        Same rules as FastQC's PhredEncoding.
+        
+        >>> FastqBasicStats.getEncoding(ord("#"))
+        u'Sanger / Illumina 1.9'
+        >>> FastqBasicStats.getEncoding(ord("B"))
+        u'Illumina 1.5'
+        """
+        if lowestChar is None:
+            return None
+        if lowestChar < 33:
+            msg = "no known encoding with chars < 33 (lowest: %i)" % lowestChar
+            raise ValueError(msg)
+        elif lowestChar < 64:
+            return "Sanger / Illumina 1.9"
+        elif lowestChar == 64 + 1:
+            return "Illumina 1.3"
+        elif lowestChar <= 126:
+            return "Illumina 1.5"
+        msg = "no known encoding with chars > 126 (lowest: %i)" % lowestChar
+        raise ValueError(msg)
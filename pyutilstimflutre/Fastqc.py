@@ -68,7 +68,12 @@ class Fastqc(object):
         # TODO
         return txt
     
-    def __init__(self, zipFile):
+    def __init__(self, zipFile, lazy=False, indexFile=None):
+        """
+        If lazy is True, only the offsets of the modules are recorded at
+        construction, and each module is parsed when getModule() is called.
+        The index can be cached in indexFile to be re-used between runs.
+        """
         self.zipFile = zipFile # ZIP file format
         if not os.path.exists(self.zipFile):
             msg = "can't find file '%s'" % self.zipFile
@@ -79,8 +84,13 @@ class Fastqc(object):
         self.root = os.path.splitext(os.path.basename(self.zipFile))[0]
         self.inFile = "fastqc_data.txt"
         self.lStats = Fastqc.initListStats()
-        self.load()
-        
+        self.indexFile = indexFile
+        self.dModules = {} # key=module name value=(status, start, end)
+        if lazy:
+            self.index()
+        else:
+            self.load()
+            
     def load(self):
         iZip = zipfile.ZipFile(self.zipFile, "r")
         tmp = "%s/%s" % (self.root, self.inFile)
@@ -125,6 +135,137 @@ class Fastqc(object):
                     self.lStats[idxModule]["content"][idxModLine]["value"] = tokens[1]
                 idxModLine += 1
                 
+    def openDataFile(self):
+        iZip = zipfile.ZipFile(self.zipFile, "r")
+        tmp = "%s/%s" % (self.root, self.inFile)
+        if tmp not in iZip.namelist():
+            msg = "'%s' not in '%s'" % (tmp, self.inFile)
+            raise ValueError(msg)
+        return iZip, iZip.open(tmp)
+    
+    def getZipSignature(self):
+        st = os.stat(self.zipFile)
+        return "%i\t%i" % (st.st_size, int(st.st_mtime))
+    
+    def index(self):
+        """
+        Record the byte offsets of each module, from the cache if possible.
+        """
+        if self.indexFile and self.loadIndex():
+            return
+        iZip, inHandle = self.openDataFile()
+        line = inHandle.readline()
+        pos = len(line) # in bytes, as the offsets given to read()
+        tokens = line.decode("utf-8").rstrip().split("\t")
+        if "FastQC" not in tokens[0]:
+            msg = "first line of '%s/%s' should contain 'FastQC'" % \
+                  (self.zipFile, self.inFile)
+            raise ValueError(msg)
+        self.lStats[0]["value"] = tokens[1]
+        name, status, start = None, None, None
+        for line in inHandle:
+            if line.startswith(b">>"):
+                if line.startswith(b">>END_MODULE"):
+                    self.dModules[name] = (status, start, pos)
+                else:
+                    tokens = line.decode("utf-8").rstrip().replace(">>", "").split("\t")
+                    name, status = tokens[0], tokens[1]
+                    start = pos + len(line)
+            pos += len(line)
+        inHandle.close()
+        iZip.close()
+        self.setStatusesFromIndex()
+        if self.indexFile:
+            self.saveIndex()
+            
+    def setStatusesFromIndex(self):
+        for dStat in self.lStats[1:]:
+            if dStat["name"] in self.dModules:
+                dStat["status"] = self.dModules[dStat["name"]][0]
+                
+    def saveIndex(self):
+        """
+        Write to a temporary file renamed at the end, so that an interrupted
+        run doesn't leave a truncated index.
+        """
+        tmpFile = "%s.tmp%i" % (self.indexFile, os.getpid())
+        outHandle = open(tmpFile, "w")
+        outHandle.write("#zip\t%s\n" % self.getZipSignature())
+        outHandle.write("#version\t%s\n" % self.lStats[0]["value"])
+        for name in sorted(self.dModules, key=lambda k: self.dModules[k][1]):
+            status, start, end = self.dModules[name]
+            outHandle.write("%s\t%s\t%i\t%i\n" % (name, status, start, end))
+        outHandle.close()
+        os.rename(tmpFile, self.indexFile) # atomic on POSIX
+        
+    def loadIndex(self):
+        """
+        Return False if the cached index is missing, stale or corrupt.
+        """
+        if not os.path.exists(self.indexFile):
+            return False
+        inHandle = open(self.indexFile, "r")
+        lines = inHandle.read().splitlines()
+        inHandle.close()
+        if len(lines) < 2 or lines[0] != "#zip\t%s" % self.getZipSignature():
+            return False
+        try:
+            version = lines[1].split("\t")[1]
+            dModules = {}
+            for line in lines[2:]:
+                tokens = line.split("\t")
+                dModules[tokens[0]] = (tokens[1], int(tokens[2]), int(tokens[3]))
+        except (IndexError, ValueError):
+            return False
+        self.lStats[0]["value"] = version
+        self.dModules = dModules
+        self.setStatusesFromIndex()
+        return True
+    
+    def getModuleNames(self):
+        if not self.dModules:
+            self.index()
+        return sorted(self.dModules, key=lambda k: self.dModules[k][1])
+    
+    def getModule(self, name):
+        """
+        Parse a single module, reading only up to its end.
+        Return a dictionary with keys "name", "status", "header" (tokens of the
+        last line starting with "#"), "extra" (list of (key, value) from the
+        previous lines starting with "#", e.g. "Total Deduplicated Percentage")
+        and "content" (list of lists of tokens).
+        """
+        if not self.dModules:
+            self.index()
+        if name not in self.dModules:
+            msg = "module '%s' not in '%s'" % (name, self.zipFile)
+            raise ValueError(msg)
+        status, start, end = self.dModules[name]
+        iZip, inHandle = self.openDataFile()
+        inHandle.read(start)
+        data = inHandle.read(end - start).decode("utf-8")
+        inHandle.close()
+        iZip.close()
+        
+        dModule = {"name": name, "status": status, "header": [], "extra": [],
+                   "content": []}
+        for line in data.splitlines():
+            if line[:1] == "#":
+                if dModule["header"]:
+                    dModule["extra"].append(tuple(dModule["header"][:2]))
+                dModule["header"] = line[1:].split("\t")
+            elif line:
+                dModule["content"].append(line.split("\t"))
+        if name == self.lStats[1]["name"]:
+            # matched by name, as measures are added by recent versions (e.g.
+            # "Total Bases" in 0.12)
+            dName2Stat = dict((dStat["name"], dStat)
+                              for dStat in self.lStats[1]["content"])
+            for tokens in dModule["content"]:
+                if tokens[0] in dName2Stat and len(tokens) > 1:
+                    dName2Stat[tokens[0]]["value"] = tokens[1]
+        return dModule
+    
     def getTxtToWrite(self):
         txt = ""
         # TODO
@@ -88,7 +88,7 @@ class JobManager(object):
         self.groupId2group[jobGroupId].wait(self.db, rmvBash, verbose)
         
     def close(self):
-        self.db.conn.close()
+        self.db.close()
         os.remove(self.path2db)
         
         
@@ -164,14 +164,12 @@ class JobGroup(object):
     def updateStatusOfFinishedJobs(self, lUnfinishedJobIds, db):
         # retrieve job ids of finished jobs (i.e. not in qstat anymore)
         # whose status in the table still is "waiting"
-        cmd = "SELECT jobid FROM jobs WHERE groupid=\"%s\"" % self.id
+        cmd = "SELECT jobid FROM jobs WHERE groupid=?"
         cmd += " AND status=\"waiting\""
         if len(lUnfinishedJobIds) > 0:
             cmd += " AND jobid NOT IN (%s)" % ",".join([str(jobId) for jobId \
                                                         in lUnfinishedJobIds])
-        db.cur.execute(cmd)
-        lFinishedWaitingJobIds = db.cur.fetchall()
-        lFinishedWaitingJobIds = [i[0] for i in lFinishedWaitingJobIds]
+        lFinishedWaitingJobIds = [row[0] for row in db.iterRows(cmd, (self.id,))]
         
         if len(lFinishedWaitingJobIds) > 0:
             # for each of them, scan stdout+err, and set their new status
@@ -275,26 +273,18 @@ class Job(object):
         lColNames = db.getColumnList("jobs")
         cmd = "INSERT INTO jobs"
         cmd += "(%s)" % ", ".join(lColNames[:(-1)])
-        cmd += " VALUES"
-        cmd += " (%s" % self.id
-        cmd += ", '%s'" % self.name
-        cmd += ", '%s'" % self.dir
-        cmd += ", '%s'" % self.groupId
-        cmd += ", '%s'" % self.queue
-        if self.lResources:
-            cmd += ", '%s'" % " ".join(self.lResources)
-        else:
-            cmd += ", ''"
-        cmd += ", '%s')" % "waiting"
-        db.execomm(cmd)
+        cmd += " VALUES (?, ?, ?, ?, ?, ?, ?)"
+        resources = " ".join(self.lResources) if self.lResources else ""
+        db.execomm(cmd, (self.id, self.name, self.dir, self.groupId, self.queue,
+                         resources, "waiting"))
         
     def updateStatusIntoDb(self, db, status):
         cmd = "UPDATE jobs"
-        cmd += " SET status=\"%s\"" % status
-        cmd += " WHERE groupid=\"%s\"" % self.groupId
-        cmd += " AND jobname=\"%s\"" % self.name
-        cmd += " AND queue=\"%s\"" % self.queue
-        db.execomm(cmd)
+        cmd += " SET status=?"
+        cmd += " WHERE groupid=?"
+        cmd += " AND jobname=?"
+        cmd += " AND queue=?"
+        db.execomm(cmd, (status, self.groupId, self.name, self.queue))
         
     def submit(self, scheduler, queue, db, lResources=None):
         self.queue = queue
@@ -12,21 +12,85 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import errno
 import subprocess
-import string
+import threading
 
 from pyutilstimflutre import Utils
 
 class ProgVersion(object):
     """
     Get the version of external programs.
+    Versions are cached in a file, keyed on the path, size and modification
+    time of the binary (or jar), so that they are only computed once.
     """
     
+    cacheFile = os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                            os.path.expanduser("~/.cache")),
+                             "pyutilstimflutre", "progversions.txt")
+    dCache = None # key=(kind, path, size, mtime) value=(major, minor); loaded lazily
+    lock = threading.Lock()
+    
     def __init__(self):
         pass
     
     @staticmethod
-    def getVersion(binName):
+    def getCacheKey(kind, path):
+        # symlinks (e.g. from environment modules) are keyed on their target
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return (kind, path, "%i" % st.st_size, "%i" % int(st.st_mtime))
+    
+    @staticmethod
+    def loadCache():
+        ProgVersion.dCache = {}
+        if ProgVersion.cacheFile is None \
+           or not os.path.exists(ProgVersion.cacheFile):
+            return
+        inHandle = open(ProgVersion.cacheFile, "r")
+        for line in inHandle:
+            tokens = line.rstrip("\n").split("\t")
+            if len(tokens) != 6:
+                continue
+            ProgVersion.dCache[tuple(tokens[:4])] = (int(tokens[4]),
+                                                     int(tokens[5]))
+        inHandle.close()
+        
+    @staticmethod
+    def getCached(key, func=None):
+        """
+        Return the version corresponding to key, calling func() to compute it
+        if it isn't in the cache yet (or returning None if func is None).
+        """
+        with ProgVersion.lock:
+            if ProgVersion.dCache is None:
+                ProgVersion.loadCache()
+            if key in ProgVersion.dCache:
+                return ProgVersion.dCache[key]
+        if func is None:
+            return None
+        majVer, minVer = func()
+        with ProgVersion.lock:
+            if key in ProgVersion.dCache: # e.g. two symlinks to the same binary
+                return ProgVersion.dCache[key]
+            ProgVersion.dCache[key] = (majVer, minVer)
+            if ProgVersion.cacheFile is not None:
+                cacheDir = os.path.dirname(ProgVersion.cacheFile)
+                if cacheDir and not os.path.exists(cacheDir):
+                    try:
+                        os.makedirs(cacheDir)
+                    except OSError as e: # created meanwhile by another process
+                        if e.errno != errno.EEXIST:
+                            raise
+                outHandle = open(ProgVersion.cacheFile, "a")
+                outHandle.write("%s\t%i\t%i\n" % ("\t".join(key), majVer,
+                                                    minVer))
+                outHandle.close()
+        return majVer, minVer
+    
+    @staticmethod
+    def getVersion(binName, onlyCached=False):
         """
         Parse --version following http://www.gnu.org/s/help2man.
         
@@ -36,23 +100,61 @@ class ProgVersion(object):
         >>> type(minVer)
         <type 'int'>
         """
-        args = [binName, "--version"]
-        p = subprocess.check_output(args)
-        p = p.splitlines()
-        version = p[0].split(" ")[-1]
-        majVer = int(version.split(".")[0])
-        minVer = int(version.split(".")[1])
-        return majVer, minVer
+        binPath = Utils.getProgramPath(binName)
+        def compute():
+            args = [binPath, "--version"]
+            p = subprocess.check_output(args).decode("utf-8")
+            p = p.splitlines()
+            version = p[0].split(" ")[-1]
+            majVer = int(version.split(".")[0])
+            minVer = int(version.split(".")[1])
+            return majVer, minVer
+        return ProgVersion.getCached(ProgVersion.getCacheKey("gnu", binPath),
+                                     None if onlyCached else compute)
     
     @staticmethod
-    def getVersionGatk(pathToJar=None):
+    def getVersionGatk(pathToJar=None, onlyCached=False):
         if pathToJar == None:
             pathToJar = Utils.getProgramPath("GenomeAnalysisTK.jar")
-        args = ["java", "-Xmx1g", "-jar", pathToJar, "--version"]
-        # p = subprocess.Popen(args, shell=True, stdout=subprocess.PIPE).communicate()
-        cmd = " ".join(args)
-        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE).communicate()
-        version = p[0].split("-")[0]
-        majVer = int(version.split(".")[0])
-        minVer = int(version.split(".")[1])
-        return majVer, minVer
+        pathToJar = os.path.abspath(pathToJar)
+        def compute():
+            args = [Utils.getProgramPath("java"), "-Xmx1g", "-jar", pathToJar,
+                    "--version"]
+            p = subprocess.Popen(args, stdout=subprocess.PIPE).communicate()
+            version = p[0].decode("utf-8").split("-")[0]
+            majVer = int(version.split(".")[0])
+            minVer = int(version.split(".")[1])
+            return majVer, minVer
+        return ProgVersion.getCached(ProgVersion.getCacheKey("gatk", pathToJar),
+                                     None if onlyCached else compute)
+    
+    @staticmethod
+    def getVersions(lBinNames, nbThreads=8):
+        """
+        Probe many programs, the ones not in the cache being probed in
+        parallel, GATK being recognized by the name of its jar.
+        Return a dictionary with key=name and value=(major, minor), or None if
+        the program can't be found or its version can't be parsed.
+        """
+        setFailed = set()
+        def probe(binName, onlyCached=False):
+            try:
+                if os.path.basename(binName) == "GenomeAnalysisTK.jar":
+                    return binName, ProgVersion.getVersionGatk(
+                        binName if os.path.dirname(binName) else None,
+                        onlyCached)
+                return binName, ProgVersion.getVersion(binName, onlyCached)
+            except (ValueError, IndexError, OSError,
+                    subprocess.CalledProcessError):
+                setFailed.add(binName)
+                return binName, None
+        dVersions = dict(probe(binName, True) for binName in lBinNames)
+        lMissing = [binName for binName in lBinNames
+                    if dVersions[binName] is None and binName not in setFailed]
+        if len(lMissing) > 0:
+            from multiprocessing.pool import ThreadPool # slow to import
+            pool = ThreadPool(min(nbThreads, len(lMissing)))
+            dVersions.update(pool.map(probe, lMissing))
+            pool.close()
+            pool.join()
+        return dVersions
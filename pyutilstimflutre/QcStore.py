@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Store per-sample QC metrics from FastQC and SamTools FlagStat in sqlite
+
+# Copyright (C) 2016 Institut National de la Recherche Agronomique (INRA)
+# License: GPL-3+
+# Persons: Timothée Flutre [cre,aut]
+# Versioning: https://github.com/timflutre/pyutilstimflutre
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+
+from pyutilstimflutre import DbSqlite, Fastqc, SamtoolsFlagstat
+
+
+class QcStore(object):
+    """
+    Per-sample QC metrics from FastQC (Fastqc or FastqBasicStats objects) and
+    from samtools flagstat (SamtoolsFlagstat or BamFlagstat objects), in indexed
+    tables of a single sqlite db, so that they can be queried together via the
+    "qc" view, e.g.:
+    SELECT sample FROM qc WHERE perc_gc > 55 AND perc_mapped < 90
+    Each table has one row per sample and file, a file loaded again replacing
+    its previous row. The view has one row per combination of the files of a
+    sample (e.g. R1 and R2 for FastQC), hence aggregates are better computed
+    on the tables.
+    """
+    
+    @staticmethod
+    def getFastqcColumns():
+        """
+        Return a list of (column name, SQL type) for the "Basic Statistics".
+        """
+        dTypes = {"total.nb.sequences": "INT",
+                  "seq.poor.qual": "INT",
+                  "perc.gc": "REAL"}
+        lCols = [("fastqc_version", "TEXT"), ("basic_stats_status", "TEXT")]
+        for dStat in Fastqc.initListStats()[1]["content"]:
+            lCols.append((dStat["id"].replace(".", "_"),
+                          dTypes.get(dStat["id"], "TEXT")))
+        return lCols
+        
+    @staticmethod
+    def getFlagstatColumns():
+        """
+        Return a list of (column name, SQL type).
+        """
+        lCols = []
+        for dStat in SamtoolsFlagstat.initListStats() \
+            + SamtoolsFlagstat.initListExtraStats():
+            lCols.append(("%s_qc_passed" % dStat["id"], "INT"))
+            lCols.append(("%s_qc_failed" % dStat["id"], "INT"))
+        lCols.append(("perc_mapped", "REAL"))
+        return lCols
+        
+    @staticmethod
+    def convert(value, sqlType):
+        if value is None or sqlType == "TEXT":
+            return value
+        if sqlType == "INT":
+            return int(value)
+        return float(value)
+        
+    def __init__(self, path2db, dPragmas=None):
+        """
+        The db is created if it doesn't exist yet.
+        """
+        if dPragmas is None:
+            dPragmas = DbSqlite.dFastPragmas
+        self.path2db = path2db
+        self.lFastqcCols = QcStore.getFastqcColumns()
+        self.lFlagstatCols = QcStore.getFlagstatColumns()
+        if os.path.exists(self.path2db):
+            self.db = DbSqlite(self.path2db, mode="rw", dPragmas=dPragmas)
+        else:
+            self.db = DbSqlite(self.path2db, dPragmas=dPragmas)
+            self.setUpTables()
+            
+    def close(self):
+        self.db.close()
+        
+    def setUpTables(self):
+        with self.db.transaction():
+            self.db.execute("CREATE TABLE samples (sample TEXT PRIMARY KEY)")
+            
+            cmd = "CREATE TABLE fastqc"
+            cmd += " (sample TEXT NOT NULL,"
+            cmd += " file TEXT NOT NULL,"
+            cmd += ",".join([" %s %s" % col for col in self.lFastqcCols])
+            cmd += ")"
+            self.db.execute(cmd)
+            self.db.execute("CREATE UNIQUE INDEX fastqc_sample_file"
+                            " ON fastqc (sample, file)")
+            self.db.execute("CREATE INDEX fastqc_perc_gc ON fastqc (perc_gc)")
+            
+            cmd = "CREATE TABLE flagstat"
+            cmd += " (sample TEXT NOT NULL,"
+            cmd += " file TEXT NOT NULL,"
+            cmd += ",".join([" %s %s" % col for col in self.lFlagstatCols])
+            cmd += ")"
+            self.db.execute(cmd)
+            self.db.execute("CREATE UNIQUE INDEX flagstat_sample_file"
+                            " ON flagstat (sample, file)")
+            self.db.execute("CREATE INDEX flagstat_perc_mapped"
+                            " ON flagstat (perc_mapped)")
+            
+            cmd = "CREATE VIEW qc AS SELECT samples.sample AS sample,"
+            cmd += " fastqc.file AS fastqc_file,"
+            cmd += ",".join([" fastqc.%s AS %s" % (col[0], col[0])
+                             for col in self.lFastqcCols])
+            cmd += ", flagstat.file AS flagstat_file,"
+            cmd += ",".join([" flagstat.%s AS %s" % (col[0], col[0])
+                             for col in self.lFlagstatCols])
+            cmd += " FROM samples"
+            cmd += " LEFT JOIN fastqc ON fastqc.sample = samples.sample"
+            cmd += " LEFT JOIN flagstat ON flagstat.sample = samples.sample"
+            self.db.execute(cmd)
+            
+    def getFastqcRow(self, sample, iFastqc):
+        lStats = iFastqc.lStats
+        if hasattr(iFastqc, "getModule") \
+           and any(dStat["value"] is None for dStat in lStats[1]["content"]):
+            # lazy Fastqc object, only having the statuses
+            iFastqc.getModule(lStats[1]["name"])
+        inFile = getattr(iFastqc, "zipFile", getattr(iFastqc, "inFile", None))
+        row = [sample, inFile, lStats[0]["value"], lStats[1]["status"]]
+        for idx,dStat in enumerate(lStats[1]["content"]):
+            row.append(QcStore.convert(dStat["value"],
+                                       self.lFastqcCols[2 + idx][1]))
+        return row
+        
+    def getFlagstatRow(self, sample, iFlagstat):
+        row = [sample, iFlagstat.inFile]
+        for dStat in iFlagstat.lStats + iFlagstat.lExtraStats:
+            row += [dStat["qc.passed"], dStat["qc.failed"]]
+        dStats = dict((dStat["id"], dStat) for dStat in iFlagstat.lStats)
+        total = dStats["total"]["qc.passed"]
+        row.append(100.0 * dStats["map"]["qc.passed"] / total if total > 0
+                   else None)
+        return row
+        
+    def insertRows(self, table, nbCols, iterRows):
+        """
+        Insert all rows in a single transaction, as well as their samples.
+        """
+        setSamples = set()
+        def iterRowsRecordingSamples():
+            for row in iterRows:
+                setSamples.add(row[0])
+                yield row
+        cmd = "INSERT OR REPLACE INTO %s VALUES (%s)" % (table,
+                                                         ", ".join(["?"] * nbCols))
+        with self.db.transaction():
+            self.db.executemany(cmd, iterRowsRecordingSamples())
+            self.db.executemany("INSERT OR IGNORE INTO samples VALUES (?)",
+                                ((sample,) for sample in setSamples))
+            
+    def insertFastqc(self, iterSampleStats):
+        """
+        Insert an iterable of (sample, Fastqc or FastqBasicStats object).
+        """
+        self.insertRows("fastqc", 2 + len(self.lFastqcCols),
+                        (self.getFastqcRow(sample, iFastqc)
+                         for sample, iFastqc in iterSampleStats))
+        
+    def insertFlagstat(self, iterSampleStats):
+        """
+        Insert an iterable of (sample, SamtoolsFlagstat or BamFlagstat object).
+        """
+        self.insertRows("flagstat", 2 + len(self.lFlagstatCols),
+                        (self.getFlagstatRow(sample, iFlagstat)
+                         for sample, iFlagstat in iterSampleStats))
+        
+    def loadFastqcFiles(self, iterSampleFiles):
+        """
+        Parse and insert an iterable of (sample, ZIP file from fastqc), one file
+        being parsed at a time, only up to the end of its "Basic Statistics".
+        """
+        self.insertFastqc((sample, Fastqc(zipFile, lazy=True))
+                          for sample, zipFile in iterSampleFiles)
+        
+    def loadFlagstatFiles(self, iterSampleFiles):
+        """
+        Parse and insert an iterable of (sample, output file of samtools
+        flagstat), one file being parsed at a time.
+        """
+        self.insertFlagstat((sample, SamtoolsFlagstat(inFile))
+                            for sample, inFile in iterSampleFiles)
+        
+    def getSamples(self, where="1", params=None):
+        """
+        Return the samples of the "qc" view satisfying the SQL condition, e.g.
+        getSamples("perc_gc > ? AND perc_mapped < ?", (55, 90)).
+        """
+        cmd = "SELECT DISTINCT sample FROM qc WHERE %s" % where
+        return [row[0] for row in self.db.iterRows(cmd, params)]
+        
+    def query(self, cmd, params=None, chunkSize=10000):
+        """
+        Yield the rows of any SQL query on the "samples", "fastqc" and
+        "flagstat" tables, or on the "qc" view.
+        """
+        return self.db.iterRows(cmd, params, chunkSize)
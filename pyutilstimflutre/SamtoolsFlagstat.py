@@ -11,13 +11,18 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
-import string
+import re
+import json
 
 class SamtoolsFlagstat(object):
     """
-    Parse the output of `samtools flagstats' (works with version 1.2).
+    Parse the output of `samtools flagstats' (works with versions from 1.2 to
+    1.x, in the default text format as well as with "-O json").
     """
     
+    reLine = re.compile(r"^(\d+) \+ (\d+) (.+?)\s*$")
+    reParenth = re.compile(r" \(([^()]*)\)$")
+    
     @staticmethod
     def initListStats():
         lStats = []
@@ -62,6 +67,115 @@ class SamtoolsFlagstat(object):
                        "qc.passed": None, "qc.failed": None})
         return lStats
     
+    @staticmethod
+    def initListExtraStats():
+        """
+        Stats only reported by recent versions of samtools (>= 1.10).
+        """
+        lStats = []
+        lStats.append({"id": "primary",
+                       "name": "primary",
+                       "qc.passed": None, "qc.failed": None})
+        lStats.append({"id": "primarydupl",
+                       "name": "primary duplicates",
+                       "qc.passed": None, "qc.failed": None})
+        lStats.append({"id": "primarymap",
+                       "name": "primary mapped",
+                       "qc.passed": None, "qc.failed": None})
+        return lStats
+    
+    @staticmethod
+    def getName2Idx(lStats):
+        return dict((dStat["name"], idx) for idx,dStat in enumerate(lStats))
+    
+    @staticmethod
+    def parseText(content, inFile):
+        lCounts = []
+        for idx,line in enumerate(content.splitlines()):
+            if line.strip() == "":
+                continue
+            m = SamtoolsFlagstat.reLine.match(line)
+            if not m:
+                msg = "output format of 'samtools flagstat' may have changed"
+                msg += " for line %i of file '%s'" % (idx + 1, inFile)
+                raise ValueError(msg)
+            name = m.group(3)
+            # remove percentages, e.g. "mapped (99.00% : N/A)",
+            # but keep "with mate mapped to a different chr (mapQ>=5)"
+            mParenth = SamtoolsFlagstat.reParenth.search(name)
+            if mParenth and (":" in mParenth.group(1) or "+" in mParenth.group(1)):
+                name = name[:mParenth.start()]
+            if name == "in total":
+                name = "total"
+            lCounts.append((name, int(m.group(1)), int(m.group(2))))
+        return lCounts
+    
+    @staticmethod
+    def parseJson(content, inFile):
+        try:
+            dContent = json.loads(content)
+            dPassed = dContent["QC-passed reads"]
+            dFailed = dContent["QC-failed reads"]
+        except (ValueError, KeyError):
+            msg = "file '%s' isn't a valid JSON output of 'samtools flagstat'" \
+                  % inFile
+            raise ValueError(msg)
+        lCounts = []
+        for key in dPassed:
+            if key.endswith("%"):
+                continue
+            name = key.replace("(mapQ >= 5)", "(mapQ>=5)")
+            lCounts.append((name, int(dPassed[key]), int(dFailed[key])))
+        return lCounts
+    
+    @staticmethod
+    def parseContent(content, inFile):
+        """
+        Auto-detect the format and return it, as well as a list of tuples
+        (name, qc.passed, qc.failed).
+        """
+        if content.lstrip().startswith("{"):
+            return "json", SamtoolsFlagstat.parseJson(content, inFile)
+        return "text", SamtoolsFlagstat.parseText(content, inFile)
+    
+    @staticmethod
+    def readContent(inFile):
+        inHandle = open(inFile, "r")
+        content = inHandle.read()
+        inHandle.close()
+        return content
+    
+    @staticmethod
+    def loadMatrix(lInFiles, withExtra=False):
+        """
+        Load many files into a single NumPy array of integers, of dimensions
+        (nb of files) x (nb of stats) x 2 (qc.passed, qc.failed), the stats
+        being ordered as in initListStats(), followed by initListExtraStats() if
+        withExtra is True (set to -1 when missing).
+        """
+        import numpy as np # optional dependency
+        lStats = SamtoolsFlagstat.initListStats()
+        nbCoreStats = len(lStats)
+        lExtraStats = SamtoolsFlagstat.initListExtraStats()
+        dName2Idx = SamtoolsFlagstat.getName2Idx(lStats + lExtraStats)
+        nbStats = nbCoreStats + (len(lExtraStats) if withExtra else 0)
+        mat = np.full((len(lInFiles), nbStats, 2), -1, dtype=np.int64)
+        for i,inFile in enumerate(lInFiles):
+            content = SamtoolsFlagstat.readContent(inFile)
+            fmt, lCounts = SamtoolsFlagstat.parseContent(content, inFile)
+            for name, passed, failed in lCounts:
+                if name not in dName2Idx:
+                    msg = "unknown stat '%s' in file '%s'" % (name, inFile)
+                    raise ValueError(msg)
+                idx = dName2Idx[name]
+                if idx < nbStats:
+                    mat[i, idx, 0] = passed
+                    mat[i, idx, 1] = failed
+            if (mat[i, :nbCoreStats, 0] < 0).any():
+                msg = "missing stat(s) in file '%s'" % inFile
+                raise ValueError(msg)
+        return mat
+    
     @staticmethod
     def header2str():
         lStats = SamtoolsFlagstat.initListStats()
@@ -72,37 +186,104 @@ class SamtoolsFlagstat(object):
             txt += "\t%s.qc.failed" % dStat["id"]
         return txt
     
-    def __init__(self, inFile):
+    @staticmethod
+    def runSamtools(bamFile, samtoolsPath="samtools", lOptions=None):
+        """
+        Run `samtools flagstat' and parse its output directly from the pipe.
+        """
+        import subprocess # imported here to keep the import of this module fast
+        args = [samtoolsPath, "flagstat"]
+        if lOptions:
+            args += lOptions
+        args += [bamFile]
+        p = subprocess.Popen(args, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            msg = "'%s' failed (exit status %i)" % (" ".join(args), p.returncode)
+            msg += "\n%s" % err.decode("utf-8").rstrip()
+            raise ValueError(msg)
+        return SamtoolsFlagstat(bamFile, out.decode("utf-8"))
+    
+    @staticmethod
+    def collect(lBamFiles, nbProcs=4, samtoolsPath="samtools", lOptions=None):
+        """
+        Run `samtools flagstat' on each BAM file, with at most nbProcs of them
+        at once, without intermediate files.
+        Yield SamtoolsFlagstat objects in the order in which they finish (their
+        inFile attribute being the BAM file).
+        """
+        from multiprocessing.pool import ThreadPool # slow to import
+        pool = ThreadPool(nbProcs)
+        try:
+            for iFlagstat in pool.imap_unordered(
+                    lambda bamFile: SamtoolsFlagstat.runSamtools(bamFile,
+                                                                 samtoolsPath,
+                                                                 lOptions),
+                    lBamFiles):
+                yield iFlagstat
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+            
+    @staticmethod
+    def collectToFile(lBamFiles, outFile, nbProcs=4, samtoolsPath="samtools",
+                      lOptions=None):
+        """
+        Write one line per BAM file as soon as its stats are available.
+        """
+        outHandle = open(outFile, "w")
+        outHandle.write("file\t%s\n" % SamtoolsFlagstat.header2str())
+        for iFlagstat in SamtoolsFlagstat.collect(lBamFiles, nbProcs,
+                                                  samtoolsPath, lOptions):
+            outHandle.write("%s\t%s\n" % (iFlagstat.inFile,
+                                          iFlagstat.getTxtToWrite()))
+            outHandle.flush()
+        outHandle.close()
+        
+    def __init__(self, inFile, content=None):
+        """
+        If content is given (output of `samtools flagstat'), it is parsed
+        instead of inFile, which is then only used in error messages.
+        """
         self.inFile = inFile
-        if not os.path.exists(self.inFile):
+        if content is None and not os.path.exists(self.inFile):
             msg = "can't find file '%s'" % self.inFile
             raise ValueError(msg)
         self.lStats = SamtoolsFlagstat.initListStats()
-        self.load()
-        
+        self.lExtraStats = SamtoolsFlagstat.initListExtraStats()
+        self.format = None # "text" or "json", set by self.load()
+        if content is None:
+            self.load()
+        else:
+            self.loadContent(content)
+            
     def load(self):
-        inHandle = open(self.inFile, "r")
-        lines = inHandle.readlines()
-        inHandle.close()
-        
-        if len(lines) != 13:
-            print(lines)
-            msg = "file '%s' has %i lines instead of 13" % (self.inFile, len(lines))
-            raise ValueError(msg)
+        content = SamtoolsFlagstat.readContent(self.inFile)
+        self.loadContent(content)
         
-        for idx,dStat in enumerate(self.lStats):
-            if string.find(lines[idx], dStat["name"]) == -1:
-                print(lines[idx])
-                msg = "can't find '%s' on line %i of file '%s'" \
-                      % (dStat["name"], idx + 1, self.inFile)
+    def loadContent(self, content):
+        self.format, lCounts = SamtoolsFlagstat.parseContent(content,
+                                                             self.inFile)
+        dName2Idx = SamtoolsFlagstat.getName2Idx(self.lStats)
+        dExtraName2Idx = SamtoolsFlagstat.getName2Idx(self.lExtraStats)
+        for name, passed, failed in lCounts:
+            if name in dName2Idx:
+                dStat = self.lStats[dName2Idx[name]]
+            elif name in dExtraName2Idx:
+                dStat = self.lExtraStats[dExtraName2Idx[name]]
+            else:
+                msg = "unknown stat '%s' in file '%s'" % (name, self.inFile)
                 raise ValueError(msg)
-            toks = lines[idx].split(" ")
-            if len(toks) < 4:
-                msg = "output format of 'samtools flagstat' may have changed"
-                msg += " for '%s' (lane %i)" % (dStat["name"], idx + 1)
+            dStat["qc.passed"] = passed
+            dStat["qc.failed"] = failed
+            
+        for dStat in self.lStats:
+            if dStat["qc.passed"] is None:
+                msg = "can't find '%s' in file '%s'" % (dStat["name"],
+                                                        self.inFile)
                 raise ValueError(msg)
-            self.lStats[idx]["qc.passed"] = int(toks[0])
-            self.lStats[idx]["qc.failed"] = int(toks[2])
             
     def getTxtToWrite(self):
         txt = "%i" % self.lStats[0]["qc.passed"]
@@ -9,13 +9,15 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
 import random
 import string
-import subprocess
 import sys
 
 class Utils(object):
     
+    dProgramPaths = {} # key=(program name, PATH) value=path; filled via findProgram()
+    
     def __init__(self):
         pass
     
@@ -34,27 +36,37 @@ class Utils(object):
         return "".join(random.choice(string.letters+string.digits) \
                        for i in xrange(length))
     
+    @staticmethod
+    def findProgram(prgName):
+        """
+        Same as `which', but in-process and memoized (per value of PATH).
+        Return None if the program can't be found.
+        """
+        envPath = os.environ.get("PATH", "")
+        key = (prgName, envPath)
+        if key not in Utils.dProgramPaths:
+            prgPath = None
+            if os.path.dirname(prgName):
+                if os.path.isfile(prgName) and os.access(prgName, os.X_OK):
+                    prgPath = os.path.abspath(prgName)
+            else:
+                for directory in envPath.split(os.pathsep):
+                    candidate = os.path.join(directory, prgName)
+                    if os.path.isfile(candidate) \
+                       and os.access(candidate, os.X_OK):
+                        prgPath = candidate
+                        break
+            Utils.dProgramPaths[key] = prgPath
+        return Utils.dProgramPaths[key]
+    
     @staticmethod
     def isProgramInPath(prgName):
-        args = ["which", prgName]
-        try:
-            p = subprocess.check_output(args, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError, e:
-            # msg = "can't find '%s' in PATH" % prgName
-            # raise ValueError(msg)
-            return False
-        else:
-            prgPath = p.rstrip()
-            return True
-
+        return Utils.findProgram(prgName) is not None
+    
     @staticmethod
     def getProgramPath(prgName):
-        args = ["which", prgName]
-        try:
-            p = subprocess.check_output(args, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError, e:
+        progPath = Utils.findProgram(prgName)
+        if progPath is None:
             msg = "can't find '%s' in PATH" % prgName
             raise ValueError(msg)
-        else:
-            progPath = p.rstrip()
-            return progPath
+        return progPath
@@ -2,9 +2,66 @@ __version__ = "0.7.0"
 # to be incremented manually
 # automatically parsed by setup.py
 
-from Fastqc import Fastqc
-from Utils import Utils
-from DbSqlite import DbSqlite
-from Jobs import JobManager, JobGroup, Job
-from SamtoolsFlagstat import SamtoolsFlagstat
-from ProgVersion import ProgVersion
+# The public classes are imported from their module only when first accessed,
+# so that a script needing e.g. SamtoolsFlagstat doesn't pay for the imports of
+# all the other modules (sqlite3, zipfile, subprocess, etc).
+
+import sys
+import types
+import importlib
+
+# key=public name value=module defining it
+dLazyAttributes = {"Fastqc": "Fastqc",
+                   "FastqBasicStats": "FastqBasicStats",
+                   "Utils": "Utils",
+                   "DbSqlite": "DbSqlite",
+                   "DbSqlitePool": "DbSqlite",
+                   "JobManager": "Jobs",
+                   "JobGroup": "Jobs",
+                   "Job": "Jobs",
+                   "SamtoolsFlagstat": "SamtoolsFlagstat",
+                   "BamFlagstat": "BamFlagstat",
+                   "ProgVersion": "ProgVersion",
+                   "QcStore": "QcStore"}
+
+__all__ = sorted(dLazyAttributes)
+
+
+class LazyModule(types.ModuleType):
+    """
+    Package whose public classes are loaded on first attribute access.
+    """
+
+    def __getattr__(self, name):
+        if name not in dLazyAttributes:
+            msg = "module '%s' has no attribute '%s'" % (self.__name__, name)
+            raise AttributeError(msg)
+        module = importlib.import_module("%s.%s" % (self.__name__,
+                                                    dLazyAttributes[name]))
+        value = getattr(module, name)
+        self.__dict__[name] = value
+        return value
+
+    def __getattribute__(self, name):
+        # once loaded, a module having the same name as its class (e.g. Utils)
+        # is set as an attribute of the package by the import system: return
+        # the class instead, as when the package was imported eagerly
+        value = types.ModuleType.__getattribute__(self, name)
+        if isinstance(value, types.ModuleType) and name in dLazyAttributes:
+            value = getattr(value, name)
+            self.__dict__[name] = value
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(dLazyAttributes))
+
+
+try:
+    sys.modules[__name__].__class__ = LazyModule
+except TypeError: # Python < 3.5 can't change the class of a module
+    lazyModule = LazyModule(__name__)
+    lazyModule.__dict__.update(sys.modules[__name__].__dict__)
+    # keep a reference to the original module, otherwise its globals would be
+    # cleared when it is garbage-collected
+    lazyModule.__dict__["originalModule"] = sys.modules[__name__]
+    sys.modules[__name__] = lazyModule